@@ -1,23 +1,176 @@
 #!/usr/bin/env python3
 import argparse
+import contextlib
+import gc
+import hashlib
+import io
 import queue
 import sys
+import threading
 import time
-import wave
-import json
 import os
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
 import sounddevice as sd
 import soundfile as sf
 import numpy  # Make sure NumPy is loaded before it is used in the callback
-assert numpy  # avoid "imported but unused" message (W0611)
 
-import whisper # if import whisper after vosk it gets stuck
+import ctranslate2
+from faster_whisper import BatchedInferencePipeline, WhisperModel, decode_audio
 from vosk import Model, KaldiRecognizer, SetLogLevel
 from google.cloud import speech
 import jiwer
+import orjson
+
+# run whisper on the GPU in float16 when there is one, otherwise int8 weights
+# halve the memory traffic of the decoder on the CPU
+WHISPER_DEVICE = "cuda" if ctranslate2.get_cuda_device_count() > 0 else "cpu"
+WHISPER_COMPUTE_TYPE = "float16" if WHISPER_DEVICE == "cuda" else "int8"
+# the engines run concurrently: whisper-large is by far the slowest so it gets
+# most of the cores, whisper-base a quarter and one core is left to the single
+# threaded vosk decoding (0 keeps the faster-whisper default)
+CPU_COUNT = os.cpu_count() or 1
+WHISPER_CPU_THREADS = {"base": max(1, CPU_COUNT // 4)}
+WHISPER_CPU_THREADS["large"] = max(1, CPU_COUNT - WHISPER_CPU_THREADS["base"] - 1)
+# number of speech segments decoded together in one forward pass
+WHISPER_BATCH_SIZE = 8
+# whisper works on 30 s windows of 16 kHz audio
+WHISPER_WINDOW = 30 * 16000
+# decoded audio of the transcribed files, keyed by the hash of their content
+CACHE_DIR = Path('~/.cache/asr_demo').expanduser()
 
 class ASR():
+    # loaded models shared by every ASR instance, loading them from disk takes
+    # way longer than the recognition itself
+    _whisper_cache = {}
+    _vosk_cache = {}
+    # creating the google client loads the credentials and opens the gRPC
+    # channel, do it once and only when google is used
+    _google_cache = {}
+    # one lock per model, the preloading thread and the recognitions must not
+    # load the same model twice
+    _cache_lock = threading.Lock()
+    _load_locks = {}
+
+    # preprocess the sentences to avoid sensitivity to spaces, punctuation
+    # and uppercase characters, built once and run by jiwer in a single pass
+    _WORD_TRANSFORM = jiwer.Compose([
+        jiwer.RemovePunctuation(),
+        jiwer.ToLowerCase(),
+        jiwer.RemoveMultipleSpaces(),
+        jiwer.Strip(),
+        jiwer.ReduceToListOfListOfWords(),
+    ])
+    _CHAR_TRANSFORM = jiwer.Compose([
+        jiwer.RemovePunctuation(),
+        jiwer.ToLowerCase(),
+        jiwer.Strip(),
+        jiwer.ReduceToListOfListOfChars(),
+    ])
+
+    @classmethod
+    def _cached(cls, cache, key, load):
+        """Return cache[key], calling load() to fill it the first time."""
+        with cls._cache_lock:
+            lock = cls._load_locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in cache:
+                cache[key] = load()
+            return cache[key]
+
+    @classmethod
+    def whisper_model(cls, model_name, device=WHISPER_DEVICE, compute_type=WHISPER_COMPUTE_TYPE):
+        """Return the whisper model, loading it only the first time.
+
+        Parameters:
+            model_name (str): the model name used by the ASR
+            device (str): device the model runs on
+            compute_type (str): precision of the model weights
+
+        Returns:
+            model (WhisperModel): the loaded model
+        """
+        def load():
+            cpu_threads = WHISPER_CPU_THREADS.get(model_name, 0)
+            try:
+                return WhisperModel(model_name, device=device, compute_type=compute_type,
+                                    cpu_threads=cpu_threads)
+            except Exception as e:
+                if device == "cpu":
+                    raise
+                # e.g. CUDA libraries missing or not matching ctranslate2
+                print(f'Could not load whisper {model_name} on {device} ({type(e).__name__}: {e}), '
+                      'falling back to the cpu', file=sys.stderr)
+                return WhisperModel(model_name, device="cpu", compute_type="int8",
+                                    cpu_threads=cpu_threads)
+
+        key = (model_name, device, compute_type)
+        return cls._cached(cls._whisper_cache, key, load)
+
+    @classmethod
+    def vosk_model(cls, model_name):
+        """Return the vosk model, loading it only the first time.
+
+        Parameters:
+            model_name (str): the name of the model
+
+        Returns:
+            model (Model): the loaded model
+        """
+        return cls._cached(cls._vosk_cache, model_name, lambda: Model(model_name=model_name))
+
+    @classmethod
+    def google_client(cls):
+        """Return the google speech client, creating it only the first time.
+
+        Returns:
+            client (SpeechClient): the speech client
+        """
+        return cls._cached(cls._google_cache, "speech_client", speech.SpeechClient)
+
+    @classmethod
+    def unload(cls, model_name=None):
+        """Release the cached models.
+
+        Parameters:
+            model_name (str): the model to release, all of them if None
+        """
+        for key in list(cls._whisper_cache):
+            if model_name is None or key[0] == model_name:
+                del cls._whisper_cache[key]
+        if model_name is None:
+            cls._vosk_cache.clear()
+        else:
+            cls._vosk_cache.pop(model_name, None)
+        gc.collect()
+
+    @staticmethod
+    def whisper_audio(content, cache_key=None):
+        """Decode an audio file to the 16 kHz float32 samples whisper works on.
+
+        Parameters:
+            content (bytes): audio file content
+            cache_key (str): key of the samples in the disk cache, they are
+                reused if stored and stored otherwise (no caching if None)
+
+        Returns:
+            audio (ndarray): the decoded samples
+        """
+        if cache_key is not None:
+            path = CACHE_DIR / (cache_key + '.npy')
+            if path.exists():
+                return numpy.load(path)
+        audio = decode_audio(io.BytesIO(content), sampling_rate=16000)
+        if cache_key is not None:
+            CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            # write aside and rename, an interrupted run must not leave a
+            # truncated entry behind
+            tmp_path = path.with_suffix('.tmp.npy')
+            numpy.save(tmp_path, audio)
+            tmp_path.replace(path)
+        return audio
+
     @staticmethod
     def compute_error_rate(reference, hypothesis):
         """Compute error rate between the reference and hypothesis sentences
@@ -31,62 +184,116 @@ class ASR():
             wer, mer, wil (tuple): word error rate, match error rate, word 
             information lost
         """
-        
-        # preprocess the sentences to avoid sensitivity to spaces, punctuation 
-        # and uppercase characters
-        reference = jiwer.RemovePunctuation()(reference)
-        reference = jiwer.ToLowerCase()(reference)
-        reference = jiwer.Strip()(reference)
+        return ASR.batch_error_rates(reference, [hypothesis])[0]
 
-        hypothesis = jiwer.RemovePunctuation()(hypothesis)
-        hypothesis = jiwer.ToLowerCase()(hypothesis)
-        hypothesis = jiwer.Strip()(hypothesis)
+    @staticmethod
+    def _alignment_counts(alignment):
+        """Count the edit operations of a jiwer alignment.
 
-        
-        output = jiwer.process_words(reference, hypothesis)
-        wer = output.wer
-        mer = output.mer
-        wil = output.wil
-        wip = output.wip
-        cer = jiwer.cer(reference, hypothesis)
-        
-        return wer, mer, wil, wip, cer
+        Parameters:
+            alignment (list): AlignmentChunk list of a sentence pair
+
+        Returns:
+            hits, substitutions, deletions, insertions (tuple): counts
+        """
+        hits = substitutions = deletions = insertions = 0
+        for chunk in alignment:
+            ref_length = chunk.ref_end_idx - chunk.ref_start_idx
+            if chunk.type == "equal":
+                hits += ref_length
+            elif chunk.type == "substitute":
+                substitutions += ref_length
+            elif chunk.type == "delete":
+                deletions += ref_length
+            else:
+                insertions += chunk.hyp_end_idx - chunk.hyp_start_idx
+        return hits, substitutions, deletions, insertions
+
+    @staticmethod
+    def batch_error_rates(reference, hypotheses):
+        """Compute the error rates of several hypotheses of the same reference
+           with a single jiwer call per measure
+
+        Parameters:
+            reference (str): reference sentence in the ground truth
+            hypotheses (list): detected sentences from the ASRs
 
-    def openwhisper_recognition(self, model_name, file_name, language_id):
+        Returns:
+            error_rates (list): (wer, mer, wil, wip, cer) tuple for each
+            hypothesis
+        """
+        # the word and char alignments are computed by rapidfuzz's C++
+        # Levenshtein (jiwer >= 3), there is no python DP loop left to compile
+        references = [reference] * len(hypotheses)
+        words = jiwer.process_words(references, hypotheses,
+                                    reference_transform=ASR._WORD_TRANSFORM,
+                                    hypothesis_transform=ASR._WORD_TRANSFORM)
+        chars = jiwer.process_characters(references, hypotheses,
+                                         reference_transform=ASR._CHAR_TRANSFORM,
+                                         hypothesis_transform=ASR._CHAR_TRANSFORM)
+
+        # jiwer aggregates the measures over all the pairs, compute them for
+        # each pair from its alignment using the same formulas
+        error_rates = []
+        for word_alignment, char_alignment in zip(words.alignments, chars.alignments):
+            H, S, D, I = ASR._alignment_counts(word_alignment)
+            wer = (S + D + I) / (H + S + D)
+            mer = (S + D + I) / (H + S + D + I)
+            wip = (H / (H + S + D)) * (H / (H + S + I)) if H + S + I >= 1 else 0
+            wil = 1 - wip
+            H, S, D, I = ASR._alignment_counts(char_alignment)
+            cer = (S + D + I) / (H + S + D)
+            error_rates.append((wer, mer, wil, wip, cer))
+        return error_rates
+
+    def openwhisper_recognition(self, model_name, audio, language_id, vad_filter=True):
         """Open whisper recognition.
         
         Parameters:
             model_name (str): the model name used by the ASR
-            file_name (str): wav filename  
-            language_id (str): language id
+            audio (str, BinaryIO or ndarray): wav file, or float32 samples
+                already at 16 kHz
+            language_id (str): language code (e.g. "en")
+            vad_filter (bool): split the audio on speech with the VAD, tile it
+                in 30 s windows otherwise
 
         Returns:
             text (str): the recognised text 
         """
         
         start = time.time()
-        model = whisper.load_model(model_name, device='cpu')
-        sentence = model.transcribe(file_name, fp16=False, language=language_id)
+        # the silero VAD (or the 30 s tiling) splits the audio in segments
+        # which are then decoded in batches instead of one after the other
+        clip_timestamps = None
+        if not vad_filter:
+            if not isinstance(audio, numpy.ndarray):
+                audio = decode_audio(audio, sampling_rate=16000)
+            clip_timestamps = [{"start": offset, "end": min(offset + WHISPER_WINDOW, len(audio))}
+                               for offset in range(0, len(audio), WHISPER_WINDOW)]
+        model = BatchedInferencePipeline(model=self.whisper_model(model_name))
+        segments, _ = model.transcribe(audio, language=language_id, beam_size=1,
+                                       vad_filter=vad_filter, clip_timestamps=clip_timestamps,
+                                       batch_size=WHISPER_BATCH_SIZE)
+        # segments is a generator, the audio is decoded while iterating it
+        sentence = "".join(segment.text for segment in segments)
         end = time.time()
-        # print(f'sentence: {sentence["text"]}, in {end-start} secs')
-        return sentence["text"], end-start
+        # print(f'sentence: {sentence}, in {end-start} secs')
+        return sentence, end-start
     
-    def google_recognition(self, config, file_name):
+    def google_recognition(self, config, content):
         """Google asr recognition.
         
         Parameters:
             config (str): RecognitionConfig object generated by the ASR
-            file_name (str): wav filename  
+            content (bytes): wav file content
 
         Returns:
             text (str): the recognised text 
         """
-        # create client instance
+        # reuse the client instance created by the first call
         start = time.time()
-        client = speech.SpeechClient()
-        with open(file_name, 'rb') as wf:
-            content = wf.read()
-            audio = speech.RecognitionAudio(content=content)
+        client = self.google_client()
+        audio = speech.RecognitionAudio(content=content)
         sentence = ""
 
         # Sends the request to google to transcribe the audio
@@ -99,31 +306,30 @@ class ASR():
         # print(f'sentence: {sentence}, in {end-start} secs')
         return sentence, end-start
     
-    def vosk_recognition(self, model_name, file_name):
+    def vosk_recognition(self, model_name, audio, rate):
         """Vosk recognition.
                 
         Parameters:
             model_name (str): the name of the model
-            file_name (str): wav filename  
+            audio (ndarray): mono 16 bit PCM samples
+            rate (int): sampling rate of the audio
 
         Returns:
             text (str): the recognised text 
         """
-        wf = wave.open(file_name, "rb")
-        model = Model(model_name=model_name)
-        rec = KaldiRecognizer(model, wf.getframerate())
-        rec.SetWords(True)
-        rec.SetPartialWords(True)
+        model = self.vosk_model(model_name)
+        # word timings are not used, leave them disabled to save decoding work
+        rec = KaldiRecognizer(model, rate)
         text = ""
         start = time.time()
-        while True:
-            data = wf.readframes(4000)
-            if len(data) == 0:
-                break
-            if rec.AcceptWaveform(data):
-                jres = json.loads(rec.Result())
+        # feed 10 s slabs, fewer round-trips through python and fewer results
+        # to parse than with small chunks
+        chunk = rate * 10
+        for i in range(0, len(audio), chunk):
+            if rec.AcceptWaveform(audio[i:i+chunk].tobytes()):
+                jres = orjson.loads(rec.Result())
                 text = text + " " + jres["text"]
-        jres = json.loads(rec.FinalResult())
+        jres = orjson.loads(rec.FinalResult())
         sentence = text + " " + jres["text"]
         end = time.time() 
         # print(f'sentence: {sentence}, in {end-start} secs')
@@ -137,11 +343,90 @@ def int_or_str(text):
     except ValueError:
         return text
 
+def preload(language):
+    """Load the models of the target language (run in a separate thread).
+
+    Parameters:
+        language (str): target language
+    """
+    vosk_models = vosk_models_by_language.get(language, {})
+    loaders = [(vosk_models.get('base'), asr.vosk_model),
+               (whisper_model[0], asr.whisper_model),
+               (vosk_models.get('large'), asr.vosk_model),
+               (whisper_model[1], asr.whisper_model)]
+    for model_name, load in loaders:
+        if model_name is None:
+            continue
+        try:
+            load(model_name)
+        except Exception as e:
+            print(f'Could not preload {model_name}: {type(e).__name__}: {e}', file=sys.stderr)
+
 def callback(indata, frames, time, status):
     """This is called (from a separate thread) for each audio block."""
     if status:
         print(status, file=sys.stderr)
-    q.put(indata.copy())
+    # no allocation on the audio thread, copy the block into a free slab
+    try:
+        idx = free_slabs.get_nowait()
+    except queue.Empty:
+        print('input overflow: no free audio slab', file=sys.stderr)
+        return
+    numpy.copyto(slabs[idx, :frames], numpy.frombuffer(indata, dtype=numpy.int16).reshape(frames, -1))
+    ready_slabs.put((idx, frames))
+
+def write_blocks(file, recording, stream_blocks, batch_frames):
+    """Collect the recorded blocks and pass them on to the streaming
+    recognizer (run in a separate thread until None is received).
+
+    Parameters:
+        file (SoundFile): file to store the recording to, if any
+        recording (list): the recorded batches are appended here
+        stream_blocks (SimpleQueue): the recorded batches are put here for
+            the streaming recognizer
+        batch_frames (int): number of frames gathered before handing them
+            over to the file and the recognizer
+    """
+    # the blocks are gathered in one preallocated batch, so the file and the
+    # recognizer are called once per batch instead of once per block (the
+    # recognizer runs in its own thread, the slabs go back to the pool without
+    # waiting for it)
+    batch = numpy.empty((batch_frames + BLOCKSIZE, slabs.shape[2]), dtype=slabs.dtype)
+    pending = 0
+    done = False
+    while not done:
+        item = ready_slabs.get()
+        if item is None:
+            done = True
+        else:
+            idx, frames = item
+            batch[pending:pending + frames] = slabs[idx, :frames]
+            pending += frames
+            free_slabs.put(idx)
+        if pending and (done or pending >= batch_frames):
+            block = batch[:pending].copy()
+            recording.append(block)
+            if file is not None:
+                file.write(block)
+            stream_blocks.put(block)
+            pending = 0
+
+def recognize_blocks(rec, texts, stream_blocks):
+    """Feed the recorded blocks to the streaming recognizer (run in a
+    separate thread until None is received).
+
+    Parameters:
+        rec (KaldiRecognizer): streaming vosk recognizer
+        texts (list): the recognised utterances are appended here
+        stream_blocks (SimpleQueue): the recorded blocks to recognise
+    """
+    while True:
+        block = stream_blocks.get()
+        if block is None:
+            break
+        # vosk expects mono 16 bit PCM
+        if rec.AcceptWaveform(block[:, 0].tobytes()):
+            texts.append(orjson.loads(rec.Result())["text"])
 
 
 parser = argparse.ArgumentParser(add_help=False)
@@ -160,6 +445,9 @@ parser = argparse.ArgumentParser(
 parser.add_argument(
     'filename', nargs='?', metavar='FILENAME',
     help='audio file to store recording to')
+parser.add_argument(
+    '-i', '--input', type=str,
+    help='transcribe an existing audio file instead of recording')
 parser.add_argument(
     '-d', '--device', type=int_or_str,
     help='input device (numeric ID or substring)')
@@ -175,11 +463,27 @@ parser.add_argument(
         '--native_language', type=str, help='native language')
 parser.add_argument(
         '--sentence', type=str, help='sentence to translate')
+parser.add_argument(
+        '--google', action='store_true',
+        help='also transcribe with the Google cloud ASR (needs credentials)')
+parser.add_argument(
+        '--no_vad', action='store_true',
+        help='tile the audio in 30 s windows for whisper instead of using the VAD')
 
 args = parser.parse_args(remaining)
+if args.input is not None and args.filename is not None:
+    parser.error('FILENAME cannot be used with --input, nothing is recorded')
 
 
-q = queue.Queue()
+# preallocated audio blocks recycled between the audio callback and the writer,
+# 16 bit PCM is all the ASR engines need
+BLOCKSIZE = 256
+N_SLABS = 1024
+slabs = numpy.empty((N_SLABS, BLOCKSIZE, args.channels), dtype='int16')
+free_slabs = queue.SimpleQueue()
+ready_slabs = queue.SimpleQueue()
+for idx in range(N_SLABS):
+    free_slabs.put(idx)
 asr = ASR()
 SetLogLevel(-1)
 
@@ -190,99 +494,154 @@ google_language_id = {"english":"en-GB",
                       "catalan":"ca-ES",
                       "french":"fr-FR"}
 whisper_model = ["base", "large"]
+whisper_language_id = {"english":"en",
+                       "italian":"it",
+                       "spanish":"es",
+                       "catalan":"ca",
+                       "french":"fr"}
 vosk_models_by_language = {"english":{'base':'vosk-model-small-en-us-0.15', 'large':'vosk-model-en-us-0.42-gigaspeech'},
                            "italian":{'base':'vosk-model-small-it-0.22', 'large':'vosk-model-it-0.22'},
                            "spanish":{'base':'vosk-model-small-es-0.42', 'large':'vosk-model-es-0.42'},
                            "catalan":{'base':'vosk-model-small-ca-0.4', 'large':'vosk-model-small-ca-0.4'},
                            "french":{'base':'vosk-model-small-fr-0.22', 'large':'vosk-model-fr-0.22'}}
 
+# load the models while recording so they are ready when the recording stops
+threading.Thread(target=preload, args=(args.target_language,), daemon=True).start()
+
 try:
-    if args.samplerate is None:
-        device_info = sd.query_devices(args.device, 'input')
-        # soundfile expects an int, sounddevice provides a float:
-        args.samplerate = int(device_info['default_samplerate'])
-    if args.filename is None:
-        args.filename = "recording.wav"
-        # Check if the file already exists in the directory and remove it if it does
-        if os.path.exists(args.filename):
-            os.remove(args.filename)
-            print(f"Removed existing file: {args.filename}")
-
-    # Make sure the file is opened before recording anything:
-    with sf.SoundFile(args.filename, mode='x', samplerate=args.samplerate,
-                      channels=args.channels, subtype=args.subtype) as file:
-        with sd.InputStream(samplerate=args.samplerate, device=args.device,
-                            channels=args.channels, callback=callback):
-            
-            print('#' * 80)
-            os.system("/bin/bash -c 'read -s -n 1 -p \"Press any key to continue...\"'")
-            print('\n')
-            print('press Ctrl+C to stop the recording')
-            print('#' * 80)
-            while True:
-                file.write(q.get())
-except KeyboardInterrupt:
-    print('\nRecording finished: ' + repr(args.filename))
-    dir = os.getcwd()
-    dir_filename =  dir+ '/' +args.filename
-    
-   
-   
-    config = speech.RecognitionConfig(
-            encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
-            enable_automatic_punctuation=True,
-            audio_channel_count=1,
-            language_code=google_language_id[args.target_language],
-        )
-    # google_sentence, _ = asr.google_recognition(config, dir_filename)
-    # g_wer, g_mer, g_wil, g_wip, g_cer  = asr.compute_error_rate(args.sentence, google_sentence)
-    
-    whisper_s_model_sentence, _ = asr.openwhisper_recognition(model_name="base", file_name=dir_filename, language_id=args.target_language)
-    ws_wer, ws_mer, ws_wil, ws_wip, ws_cer  = asr.compute_error_rate(args.sentence, whisper_s_model_sentence)
-    whisper_l_model_sentence, _ = asr.openwhisper_recognition(model_name="large", file_name=dir_filename, language_id=args.target_language)
-    wl_wer, wl_mer, wl_wil, wl_wip, wl_cer  = asr.compute_error_rate(args.sentence, whisper_l_model_sentence)
-   
-    
     vosk_small_model = vosk_models_by_language[args.target_language]['base']
-    vosk_s_model_sentence, _ = asr.vosk_recognition(vosk_small_model, dir_filename)
-    vs_wer, vs_mer, vs_wil, vs_wip, vs_cer  = asr.compute_error_rate(args.sentence, vosk_s_model_sentence)
     vosk_large_model = vosk_models_by_language[args.target_language]['large']
-    vosk_l_model_sentence, _ = asr.vosk_recognition(vosk_large_model, dir_filename)
-    vl_wer, vl_mer, vl_wil, vl_wip, vl_cer  = asr.compute_error_rate(args.sentence, vosk_l_model_sentence)
-  
+    whisper_language = whisper_language_id[args.target_language]
+
+    cache_key = None
+    if args.input is not None:
+        # transcribe an existing recording instead of recording a new one, it
+        # is likely to be transcribed again so its samples go to the disk cache
+        with open(args.input, 'rb') as wf:
+            file_content = wf.read()
+        cache_key = hashlib.sha256(file_content).hexdigest()
+        audio, args.samplerate = sf.read(io.BytesIO(file_content), dtype='int16', always_2d=True)
+        vosk_stream = None
+    else:
+        if args.samplerate is None:
+            device_info = sd.query_devices(args.device, 'input')
+            # soundfile expects an int, sounddevice provides a float:
+            args.samplerate = int(device_info['default_samplerate'])
+        # the small vosk model transcribes while recording, its text is ready as
+        # soon as the recording stops
+        vosk_stream = KaldiRecognizer(asr.vosk_model(vosk_small_model), args.samplerate)
+        vosk_stream_texts = []
+        vosk_stream_blocks = queue.SimpleQueue()
+        vosk_thread = threading.Thread(target=recognize_blocks,
+                                       args=(vosk_stream, vosk_stream_texts, vosk_stream_blocks),
+                                       daemon=True)
+        vosk_thread.start()
+        # the recording stays in memory, it is written to disk only if a
+        # filename is given
+        recording = []
+
+        try:
+            # Make sure the file is opened before recording anything:
+            with (sf.SoundFile(args.filename, mode='x', samplerate=args.samplerate,
+                               channels=args.channels, subtype=args.subtype)
+                  if args.filename else contextlib.nullcontext()) as file:
+                writer = threading.Thread(target=write_blocks, args=(file, recording, vosk_stream_blocks,
+                                                                   args.samplerate // 10))
+                writer.start()
+                try:
+                    with sd.RawInputStream(samplerate=args.samplerate, device=args.device,
+                                           channels=args.channels, dtype='int16', blocksize=BLOCKSIZE,
+                                           latency='low', callback=callback):
+                        
+                        print('#' * 80)
+                        os.system("/bin/bash -c 'read -s -n 1 -p \"Press any key to continue...\"'")
+                        print('\n')
+                        print('press Ctrl+C to stop the recording')
+                        print('#' * 80)
+                        writer.join()
+                        raise RuntimeError('the recording stopped unexpectedly')
+                finally:
+                    # let the writer drain the recorded blocks before closing the file
+                    ready_slabs.put(None)
+                    writer.join()
+                    # the recognizer catches up while the other engines run
+                    vosk_stream_blocks.put(None)
+        except KeyboardInterrupt:
+            print('\nRecording finished' + (': ' + repr(args.filename) if args.filename else ''))
+        audio = numpy.concatenate(recording) if recording else numpy.zeros((0, args.channels), dtype='int16')
+    # every engine gets the same mono 16 bit PCM straight from memory
+    pcm = numpy.ascontiguousarray(audio[:, 0])
+    wav = io.BytesIO()
+    sf.write(wav, pcm, args.samplerate, format='WAV', subtype='PCM_16')
+    wav_content = wav.getvalue()
+
+    google_future = None
+    if args.google:
+        config = speech.RecognitionConfig(
+                encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
+                enable_automatic_punctuation=True,
+                audio_channel_count=1,
+                language_code=google_language_id[args.target_language],
+            )
+        # send the audio to google right away, the network round trip is
+        # hidden behind the local engines
+        google_executor = ThreadPoolExecutor(max_workers=1)
+        google_future = google_executor.submit(asr.google_recognition, config, wav_content)
+        google_executor.shutdown(wait=False)
 
-  # Define the data
-    model_data = [
-        ('vosk_small', vs_wer, vs_mer, vs_wil, vs_wip, vs_cer),
-        ('vosk_large', vl_wer, vl_mer, vl_wil, vl_wip, vl_cer),
-        ('whisper_small', ws_wer, ws_mer, ws_wil, ws_wip, ws_cer),
-        ('whisper_large', wl_wer, wl_mer, wl_wil, wl_wip, wl_cer),
-    #    ('google', g_wer, g_mer, g_wil, g_wip, g_cer) 
-    ]
+    # decode and resample to the 16 kHz whisper works at once, both whisper
+    # models share the samples
+    whisper_audio = asr.whisper_audio(wav_content, cache_key=cache_key)
+
+    # the engines only read the recording, run them concurrently so the total
+    # time is the one of the slowest model instead of the sum of all of them
+    recognitions = {
+        'whisper_small': lambda: asr.openwhisper_recognition(model_name="base", audio=whisper_audio,
+                                                             language_id=whisper_language,
+                                                             vad_filter=not args.no_vad),
+        'whisper_large': lambda: asr.openwhisper_recognition(model_name="large", audio=whisper_audio,
+                                                             language_id=whisper_language,
+                                                             vad_filter=not args.no_vad),
+        'vosk_large': lambda: asr.vosk_recognition(vosk_large_model, pcm, args.samplerate),
+    }
+    if vosk_stream is None:
+        recognitions['vosk_small'] = lambda: asr.vosk_recognition(vosk_small_model, pcm, args.samplerate)
+    with ThreadPoolExecutor(max_workers=len(recognitions)) as executor:
+        futures = {name: executor.submit(recognition) for name, recognition in recognitions.items()}
+        model_sentences = {name: future.result()[0] for name, future in futures.items()}
+    if vosk_stream is not None:
+        vosk_thread.join()
+        vosk_stream_texts.append(orjson.loads(vosk_stream.FinalResult())["text"])
+        model_sentences['vosk_small'] = " ".join(vosk_stream_texts)
+
+    model_names = ['vosk_small', 'vosk_large', 'whisper_small', 'whisper_large']
+    sentences = [model_sentences[model_name] for model_name in model_names]
+    if google_future is not None:
+        try:
+            google_sentence, _ = google_future.result()
+            model_names.append('google')
+            sentences.append(google_sentence)
+        except Exception as e:
+            print(f'Google recognition failed: {type(e).__name__}: {e}', file=sys.stderr)
+    error_rates = asr.batch_error_rates(args.sentence, sentences)
+
+  # Define the data, formatted once as the strings to print
+    header = ('Model', 'WER', 'MER', 'WIL', 'WIP', 'CER')
+    rows = [[model_name] + [f'{rate:.4f}' for rate in rates]
+            for model_name, rates in zip(model_names, error_rates)]
 
 
     print(f"TARGET LANGUAGE: {args.target_language}")
     print(f"TARGET SENTENCE: {args.sentence}")
 
     # Calculate the maximum width for each column
-    column_widths = [max(len(str(model[i])) for model in model_data) for i in range(len(model_data[0]))]
-
-    # Print the header
-    print("+" + "-"*(sum(column_widths) + 13) + "+")
-    print(f"| {'Model':<{column_widths[0]}} | {'WER':<{column_widths[1]}} | {'MER':<{column_widths[2]}} | {'WIL':<{column_widths[3]}} | {'WIP':<{column_widths[4]}} | {'CER':<{column_widths[5]}} |")
-    print("+" + "-"*(sum(column_widths) + 13) + "+")
-
-    # Print the data
-    for model_info in model_data:
-        model_name = model_info[0]
-        model_values = model_info[1:]
-        print(f"| {model_name:<{column_widths[0]}} |", end=' ')
-        for i, value in enumerate(model_values):
-            print(f"{value:<{column_widths[i+1]}} |", end=' ')
-        print()
-
-    # Print the footer
-    print("+" + "-"*(sum(column_widths) + 13) + "+")
+    column_widths = [max(map(len, column)) for column in zip(header, *rows)]
+
+    # Print the table in one go
+    separator = "+" + "+".join("-" * (width + 2) for width in column_widths) + "+"
+    lines = ["| " + " | ".join(f"{value:<{width}}" for value, width in zip(row, column_widths)) + " |"
+             for row in [header] + rows]
+    print("\n".join([separator, lines[0], separator] + lines[1:] + [separator]))
     
     parser.exit(0)
 except Exception as e: